@@ -0,0 +1,199 @@
+#!/usr/bin/python
+""" Colouring and annotation of trees, and writing them out, shared by the CLI (chroma_clade.py)
+    and the other modules. Kept apart from the CLI script so they can import it without running it.
+"""
+from itertools import chain 
+import copy
+import re
+
+from tree_io import newick_modules, phylo
+
+
+UNKNOWN_STATE_COL = '#797D7F' # dark grey
+
+COL_ATTRIB = "[&!color=%s]"
+STATE_SUFFIX = "__site_%d__%s"
+COLLAPSED_NAME = "clade_n%d__%d_taxa" # preorder index and number of taxa of a collapsed clade
+
+# Structure of a Nexus tree-only file 
+NEX_TEMPLATE = """#NEXUS 
+Begin Taxa; 
+Dimensions NTax=%(count)d; 
+TaxLabels %(labels)s; 
+End; 
+Begin Trees; 
+%(trees)s 
+End;""" 
+# 'index' starts from 1; 'tree' is the Newick tree string 
+TREE_TEMPLATE = "Tree tree%(index)d=%(tree)s" # TODO could have rooting information here
+
+GENERIC_ERR_MSG = """Oops: an error occured, please check input settings and try again. Message:"""
+
+
+def make_trees(tree, aln, sites, colours, collapse=None):
+    """ A coloured and annotated copy of the tree for each site.
+        If 'collapse' is given, single-state clades of at least that many taxa are collapsed to one tip.
+    """
+    taxon_dict = dict([ (aln[i].id, i) for i in range(len(aln)) ]) # maps taxon identifiers to their alignment indices 
+    if collapse != None:
+        tip_counts = [ clade.count_terminals() for clade in tree.find_clades(order="preorder") ]
+    
+    trees = []
+    for site in sites:
+        tree_copy = copy.deepcopy(tree)
+        states = list(colours.keys())
+        vectors = {} if collapse != None else None
+        colour_tree(tree_copy.root, aln, taxon_dict, site, colours, states, vectors)
+        annotate_site_state(tree_copy, aln, taxon_dict, site) # add site and state info
+        if collapse != None:
+            collapse_clades(tree_copy, vectors, states, site, collapse, tip_counts)
+        trees.append(tree_copy)
+    return trees
+
+
+def output_xml(coloured_trees, path, colour_branches):
+    Phylo = phylo()
+    from Bio.Phylo import PhyloXML
+    BranchColor = newick_modules()[0].BranchColor
+
+    # adding font as a property of each tip clade, to show colour
+    coloured_trees = [ PhyloXML.Phylogeny.from_tree(tree) for tree in coloured_trees ]# convert to PhyloNexus
+    for tree in coloured_trees:
+        for clade in tree.get_terminals():
+            value = BranchColor.to_hex(clade.color) # value of the property (ie the colour)
+            clade.properties = [PhyloXML.Property(value, "style:font_color", "node", "xsd:token")]
+        
+        if not colour_branches: 
+            for clade in tree.get_nonterminals() + tree.get_terminals():
+                clade.color = None
+    Phylo.write(coloured_trees, path, "phyloxml")
+
+
+def output_figtree(coloured_trees, path, colour_branches, colours):
+    annotate_branch_colours(coloured_trees, colour_branches)
+    f = open(path, "w")
+    f.write(nexus_text(coloured_trees, colour_branches, colours).replace("'", ""))
+    f.close()
+    # the Bio code automatically adds inverted commas to colour attribute lables, which prevents figtree reading them as annotations
+
+
+def annotate_branch_colours(coloured_trees, colour_branches):
+    """ Add FigTree colour annotation to clade names, if branches are being coloured """
+    BranchColor = newick_modules()[0].BranchColor
+
+    if colour_branches:
+        for tree in coloured_trees:
+            for clade in tree.get_nonterminals():
+                clade.name = COL_ATTRIB % BranchColor.to_hex(clade.color) # colour is stored as RGB vector, but we want RGB hex
+            for clade in tree.get_terminals():
+                clade.name += COL_ATTRIB % BranchColor.to_hex(clade.color)
+    else:
+        pass # colour labels added to taxlabel block in nexus_text
+
+def annotate_site_state(tree, alignment, taxon_dict, site):
+    """ Apply labels to tips showing site and state information (not colour)"""
+    for tip in tree.get_terminals():
+        state = alignment[ taxon_dict[tip.name] ][site].upper()
+        tip.name += (STATE_SUFFIX % (site+1, state))
+
+def colour_tree(parent, alignment, taxon_dict, site, colours, states, vectors=None):
+    """ Apply colour labels to all tips and to branches, based on parsimony inference of
+        ancestral characters, using a simplified form of Felsenstein's pruning algorithm.
+        For an internal node, 'conditional probability' for a given state is 1
+        if all descendent taxa are that state, and 0 otherwise.
+        If there is any disagreement among descendent taxa then all 'conditional probabilities' 
+        are 0, meaning we are not confident enough to assign any state to this branch.
+        If a dict is given as 'vectors', each internal node's vector is saved in it, keyed by clade.
+    """
+    if parent.is_terminal():
+        state = alignment[ taxon_dict[parent.name] ][site].upper()
+        parent_vector = [0] * len(states) 
+        try:
+            parent.color = colours[state] # color attribute stored as RGB tuple, even though value is hex representation
+            parent_vector[ states.index(state) ] = 1
+        except KeyError:
+            parent.color = UNKNOWN_STATE_COL
+        return parent_vector # if state is not recognised then parent_vector remains all 0
+    else:
+        parent_vector = [1] * len(states)
+        for child in parent:
+            child_vector = colour_tree(child, alignment, taxon_dict, site, colours, states, vectors)
+            for i in range(len(states)):
+                parent_vector[i] *= child_vector[i] # elementwise multiplication
+        z = sum(parent_vector)
+        if z == 0:
+            col = UNKNOWN_STATE_COL
+        elif z == 1:
+            col = colours[ states[parent_vector.index(1)] ]
+        else:
+            raise ValueError("Incorrect parent vector!")
+        parent.color = col # stored as RGB tuple
+        if vectors != None:
+            vectors[parent] = parent_vector
+        return parent_vector
+
+def collapse_clades(tree, vectors, states, site, min_taxa, tip_counts):
+    """ Replace each largest clade whose taxa all share one state, and which has at least min_taxa taxa,
+        with a single tip named e.g. 'clade_n123__12_taxa__site_1__T', where 123 is the clade's index in
+        preorder traversal (the same for every site) and T the shared state.
+        'vectors' are as saved by colour_tree(); tip_counts gives the number of taxa below each clade, by preorder index.
+        The root is never collapsed.
+    """
+    index = dict([ (clade, i) for i, clade in enumerate(tree.find_clades(order="preorder")) ])
+    stack = list(tree.root.clades)
+    while stack:
+        clade = stack.pop()
+        if clade.is_terminal():
+            continue
+        vector = vectors[clade]
+        n_taxa = tip_counts[index[clade]]
+        if n_taxa >= min_taxa and 1 in vector:
+            clade.name = COLLAPSED_NAME % (index[clade], n_taxa) + STATE_SUFFIX % (site+1, states[vector.index(1)])
+            clade.clades = []
+            clade.confidence = None
+        else:
+            stack.extend(clade.clades)
+
+def colour_taxon(name, colours, n_chars=1, annotation_string=COL_ATTRIB):
+    try:
+        colour = colours[name[-n_chars]]
+    except KeyError:
+        colour = UNKNOWN_STATE_COL
+    return name + annotation_string % colour
+
+# TODO could include rooted/unrooted tree information, as is now standard in nexus format
+def nexus_text(obj, colour_branches, colours, **kwargs):
+    """ Take tree-like object(s) and create nexus-format representation.
+        Allows for colouring tip names.
+        Modified from http://biopython.org/DIST/docs/api/Bio.Phylo.NexusIO-pysrc.html
+        NB here we compensate for an apparent bug in the Biopython implementation, 
+        whereby an additional colon is wrongly added to confidence values in the output tree strings.
+    """
+    return nexus_document(*nexus_parts(obj, colour_branches, colours, **kwargs))
+
+def nexus_parts(obj, colour_branches, colours, first_index=1, **kwargs):
+    """ Taxon labels and tree lines for nexus_text(), numbering trees from first_index """
+    NewickIO = newick_modules()[1]
+
+    try:
+        trees = list(obj) # assume iterable
+    except TypeError:
+        trees = [obj]
+    writer = NewickIO.Writer(trees) 
+    nexus_trees = [TREE_TEMPLATE % {'index': idx + first_index, 'tree': nwk} 
+                 for idx, nwk in enumerate( 
+      writer.to_strings(plain=False, plain_newick=True, 
+                        **kwargs))] 
+    # if branches are being coloured, then taxon names already contain colouring annotation
+    # otherwise we need to add this annotation here
+    tax_labels = [ colour_taxon(str(x.name), colours) if not colour_branches else str(x.name) for x in chain(*(t.get_terminals() for t in trees))] 
+    return tax_labels, nexus_trees
+
+def nexus_document(tax_labels, nexus_trees):
+    """ Nexus text for the given taxon labels and tree lines """
+    text = NEX_TEMPLATE % { 
+      'count': len(tax_labels), 
+      'labels': ' '.join(tax_labels), # taxlabels all on one line 
+      'trees': '\n'.join(nexus_trees), # trees on separate lines
+    }
+    return re.sub(r':([0-9]{1,3}\.[0-9]{1,3}):', r'\1:', text) # Corrects for biopython bug. eg ":50.00:" -> "50.00:"
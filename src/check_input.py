@@ -1,8 +1,9 @@
 #!/usr/bin/python
 
-from Bio import Phylo, AlignIO
 import os.path
 
+from tree_io import TREE_FORMATS, read_tree
+
 OUT_PREFIX = "col_"
 SITES_DELIM = ","
 RANGE_DELIM = "-"
@@ -11,18 +12,23 @@ COLOUR_DELIM = ","
 class InputError(ValueError):
     pass
 
+class FastaAlignment(list):
+    """ The SeqRecords of a Fasta alignment. Stands in for Bio.Align.MultipleSeqAlignment,
+        whose import (with numpy) would otherwise be most of a small job's start-up time.
+    """
+    def get_alignment_length(self): return len(self[0])
+
 class Input:
 
     DEFAULT_COL_FILE = "default_colour.csv"
 
     def __init__(self, tree_path, align_path, branches, tree_in_format,
             align_in_format, colour_file_path, output_path=None, tree_out_format=None, 
-            sites_string=""):
-        
+            sites_string="", jobs=1, checkpoint=None, resume=False, collapse=None):
         # tree and alignment formats
         tree_in_format, align_in_format = tree_in_format.lower(), align_in_format.lower()
 
-        if not tree_in_format in list(Phylo._io.supported_formats.keys()):
+        if not tree_in_format in TREE_FORMATS:
             raise InputError("Oops: named tree format not recognised")
         else:
             self.tree_in_format = tree_in_format
@@ -34,7 +40,7 @@ class Input:
         
         # tree and alignment
         try:
-            self.tree = Phylo.read(tree_path, tree_in_format) 
+            self.tree = read_tree(tree_path, tree_in_format) 
         except ValueError: # raised if 0 or >1 trees in file
             raise InputError("Oops: problem reading tree file.\n(Is the format correct?)")
         except IOError:
@@ -43,10 +49,15 @@ class Input:
             raise InputError("Oops: problem reading tree file")
         
         self.tree_path = tree_path # keep this so output file name can be made later
+        self.align_path = align_path
         self.branches = branches 
 
         try:
-            self.align = AlignIO.read(align_path, align_in_format)
+            if align_in_format == "fasta":
+                self.align = self._read_fasta(align_path)
+            else:
+                from Bio import AlignIO
+                self.align = AlignIO.read(align_path, align_in_format)
         except ValueError: # raised if 0 or >1 alignments in file
             raise InputError("Oops: problem reading alignment file.\n(Is the format correct?)")
         except IOError:
@@ -74,11 +85,46 @@ class Input:
             self.tree_out_format = "figtree"
         else:
             tree_out_format = tree_out_format.lower()
-            if not tree_out_format in ["figtree", "xml"]:
+            if not tree_out_format in ["figtree", "xml", "svg", "png"]:
                 raise InputError("Oops: named tree output format not recognised")
             else:
                 self.tree_out_format = tree_out_format
         
+        # number of processes, used when rendering images
+        try:
+            self.jobs = int(jobs)
+        except (TypeError, ValueError):
+            raise InputError("Oops: number of jobs must be a whole number")
+        if self.jobs < 1:
+            raise InputError("Oops: number of jobs must be at least 1")
+
+        # checkpointing: number of sites per chunk, or None to write everything at the end
+        if checkpoint == None:
+            self.checkpoint = None
+        else:
+            try:
+                self.checkpoint = int(checkpoint)
+            except (TypeError, ValueError):
+                raise InputError("Oops: checkpoint size must be a whole number of sites")
+            if self.checkpoint < 1:
+                raise InputError("Oops: checkpoint size must be at least 1 site")
+            if self.tree_out_format in ["svg", "png"]:
+                raise InputError("Oops: checkpoints are only for figtree or xml output.\n(Images are saved site by site anyway; use -resume to skip those already made)")
+        self.resume = resume
+
+        # collapsing single-state clades: minimum number of taxa in a collapsed clade, or None
+        if collapse == None:
+            self.collapse = None
+        else:
+            try:
+                self.collapse = int(collapse)
+            except (TypeError, ValueError):
+                raise InputError("Oops: clade size to collapse must be a whole number of taxa")
+            if self.collapse < 2:
+                raise InputError("Oops: clade size to collapse must be at least 2 taxa")
+            if self.tree_out_format in ["svg", "png"]:
+                raise InputError("Oops: clades can only be collapsed for figtree or xml output")
+
         # parse site ranges
         # NB we don't sort or remove duplicate site numbers, so user can control order and frequency
         try:
@@ -123,6 +169,32 @@ class Input:
                 sites.append(a)
         return sites
 
+    def _read_fasta(self, align_path):
+        """ Read a Fasta alignment without going through AlignIO/SeqIO, which import
+            readers for every other sequence format too.
+            Records are parsed as by SeqIO's Fasta parser (id is the first word of the title).
+        """
+        from Bio.Seq import Seq
+        from Bio.SeqRecord import SeqRecord
+
+        entries = [] # [title, [sequence lines]] pairs
+        with open(align_path) as f:
+            for line in f:
+                if line.startswith(">"):
+                    entries.append([line[1:].strip(), []])
+                elif entries:
+                    entries[-1][1].append(line.strip().replace(" ", ""))
+        if not entries:
+            raise ValueError("No records found in Fasta file")
+
+        records = []
+        for title, lines in entries:
+            seq_id = title.split(None, 1)[0] if title else ""
+            records.append(SeqRecord(Seq("".join(lines)), id=seq_id, name=seq_id, description=title))
+        if len(set([ len(record) for record in records ])) != 1:
+            raise ValueError("Sequences must all be the same length")
+        return FastaAlignment(records)
+
     # get methods
     def get_tree(self): return self.tree
     def get_align(self): return self.align
@@ -135,10 +207,15 @@ class Input:
     def get_end_site(self): return self.end_site
     
     def get_tree_path(self): return self.tree_path
+    def get_align_path(self): return self.align_path
     def get_branches(self): return self.branches
     
     def get_sites(self): return self.sites
     def get_colours(self): return self.colours
+    def get_jobs(self): return self.jobs
+    def get_checkpoint(self): return self.checkpoint
+    def get_resume(self): return self.resume
+    def get_collapse(self): return self.collapse
 
 def test():
     base_path = "/Users/cmonit1/Desktop/coloured_trees/"
@@ -0,0 +1,155 @@
+#!/usr/bin/python
+""" Checkpointed runs: trees are made and saved a chunk of sites at a time, in part files
+    next to the output, with a journal recording which chunks are finished. A run that is
+    interrupted can be carried on with -resume, and the output is only written, in one step,
+    once every chunk is done. The output is the same as that of an uninterrupted run.
+"""
+import hashlib
+import json
+import os
+import os.path
+import shutil
+
+from check_input import InputError
+from annotate import make_trees, annotate_branch_colours, nexus_parts, nexus_document, output_xml
+
+CHECKPOINT_SUFFIX = ".checkpoint" # folder for part files and journal, added to output path
+JOURNAL_NAME = "journal.json"
+FINGERPRINT_NAME = "fingerprint.txt" # in the image folder, for svg/png output
+PART_NAME = "part_%d.%s" # chunk number, extension
+TMP_SUFFIX = ".tmp"
+DEFAULT_CHUNK_SIZE = 100 # sites, if resuming without a journal or chunk size
+
+
+def job_fingerprint(usr):
+    """ Identifies a job by its input files and the options affecting its output,
+        so that a checkpoint isn't resumed with different settings
+    """
+    h = hashlib.sha1()
+    for path in [usr.get_tree_path(), usr.get_align_path()]:
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    h.update(json.dumps([ usr.get_tree_in_format(), usr.get_align_in_format(), usr.get_tree_out_format(),
+            usr.get_branches(), usr.get_sites(), sorted(usr.get_colours().items()), usr.get_collapse() ]).encode())
+    return h.hexdigest()
+
+
+def write_atomic(path, text):
+    """ Write text to a temporary file and then move it into place, so path is either complete or absent """
+    f = open(path + TMP_SUFFIX, "w")
+    f.write(text)
+    f.close()
+    os.replace(path + TMP_SUFFIX, path)
+
+
+def check_image_folder(usr):
+    """ For svg/png output, record the job's fingerprint in the image folder, so that a run
+        resumed there with -resume can check that the images already made are for the same job
+    """
+    folder = usr.get_output_path()
+    path = os.path.join(folder, FINGERPRINT_NAME)
+    fingerprint = job_fingerprint(usr)
+
+    if usr.get_resume() and os.path.exists(folder):
+        if os.path.exists(path):
+            with open(path) as f:
+                saved = f.read().strip()
+        else: # images from a run that didn't record its fingerprint can't be checked
+            saved = None if any(name.startswith("site_") for name in os.listdir(folder)) else fingerprint
+        if saved != fingerprint:
+            raise InputError("Oops: the images in the output folder are for different input or options.\n(Run without -resume to start again)")
+    elif not os.path.exists(folder):
+        os.makedirs(folder)
+    write_atomic(path, fingerprint + "\n")
+
+
+class Checkpoint:
+    """ Folder of finished chunks and a journal describing them """
+
+    def __init__(self, usr, chunk_size, resume):
+        self.folder = usr.get_output_path() + CHECKPOINT_SUFFIX
+        self.journal_path = os.path.join(self.folder, JOURNAL_NAME)
+        fingerprint = job_fingerprint(usr)
+
+        if resume and os.path.exists(self.journal_path):
+            with open(self.journal_path) as f:
+                self.journal = json.load(f)
+            if self.journal["fingerprint"] != fingerprint:
+                raise InputError("Oops: the saved checkpoint is for different input or options.\n(Run without -resume to start again)")
+            if chunk_size != None and chunk_size != self.journal["chunk_size"]:
+                raise InputError("Oops: the saved checkpoint uses chunks of %d sites, not %d.\n(Resume with -checkpoint %d, or without -checkpoint)" % (self.journal["chunk_size"], chunk_size, self.journal["chunk_size"]))
+        else: # start afresh, discarding any earlier checkpoint
+            if os.path.exists(self.folder):
+                shutil.rmtree(self.folder)
+            os.makedirs(self.folder)
+            self.journal = {"fingerprint": fingerprint, "chunk_size": chunk_size or DEFAULT_CHUNK_SIZE, "done": []}
+            self._save()
+
+    def _save(self):
+        write_atomic(self.journal_path, json.dumps(self.journal))
+
+    def get_chunk_size(self): return self.journal["chunk_size"]
+    def is_done(self, chunk): return chunk in self.journal["done"]
+    def part_path(self, chunk, ext): return os.path.join(self.folder, PART_NAME % (chunk, ext))
+
+    def commit(self, chunk):
+        """ Record a chunk as finished, once its part file is in place """
+        self.journal["done"].append(chunk)
+        self._save()
+
+    def remove(self):
+        shutil.rmtree(self.folder)
+
+
+def run_checkpointed(usr):
+    tree, aln = usr.get_tree(), usr.get_align()
+    sites, out_format = usr.get_sites(), usr.get_tree_out_format()
+    ckpt = Checkpoint(usr, usr.get_checkpoint(), usr.get_resume())
+    size = ckpt.get_chunk_size()
+    chunks = [ sites[i:i + size] for i in range(0, len(sites), size) ]
+
+    for chunk, chunk_sites in enumerate(chunks):
+        if ckpt.is_done(chunk):
+            continue
+        trees = make_trees(tree, aln, chunk_sites, usr.get_colours(), usr.get_collapse())
+        if out_format == "xml":
+            path = ckpt.part_path(chunk, "xml")
+            output_xml(trees, path + TMP_SUFFIX, usr.get_branches())
+            os.replace(path + TMP_SUFFIX, path)
+        else:
+            annotate_branch_colours(trees, usr.get_branches())
+            tax_labels, nexus_trees = nexus_parts(trees, usr.get_branches(), usr.get_colours(), first_index=chunk * size + 1)
+            write_atomic(ckpt.part_path(chunk, "json"), json.dumps({"labels": tax_labels, "trees": nexus_trees}))
+        ckpt.commit(chunk)
+
+    out_path = usr.get_output_path()
+    if out_format == "xml":
+        join_xml([ ckpt.part_path(chunk, "xml") for chunk in range(len(chunks)) ], out_path + TMP_SUFFIX)
+    else:
+        tax_labels, nexus_trees = [], []
+        for chunk in range(len(chunks)):
+            with open(ckpt.part_path(chunk, "json")) as f:
+                part = json.load(f)
+            tax_labels.extend(part["labels"])
+            nexus_trees.extend(part["trees"])
+        f = open(out_path + TMP_SUFFIX, "w")
+        f.write(nexus_document(tax_labels, nexus_trees).replace("'", "")) # as in output_figtree()
+        f.close()
+    os.replace(out_path + TMP_SUFFIX, out_path)
+    ckpt.remove()
+
+
+def join_xml(part_paths, path):
+    """ Join PhyloXML files into one, keeping the opening and closing <phyloxml> tags
+        of the first and last and the <phylogeny> elements of all of them.
+        Relies on the opening tag being on its own line, as Phylo.write() does.
+    """
+    out = open(path, "w")
+    for i, part_path in enumerate(part_paths):
+        with open(part_path) as f:
+            text = f.read()
+        start = 0 if i == 0 else text.index("\n") + 1 # after the opening tag
+        end = len(text) if i == len(part_paths) - 1 else text.rindex("</") # before the closing tag
+        out.write(text[start:end])
+    out.close()
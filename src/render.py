@@ -0,0 +1,194 @@
+#!/usr/bin/python
+""" Headless rendering of colour-annotated trees to SVG or PNG, one image per site.
+    The layout (node coordinates, tip order, label space) is computed once from the
+    input tree and reused for every site; only the colours and tip labels change.
+"""
+import os
+import os.path
+
+from annotate import colour_tree, STATE_SUFFIX
+from tree_io import newick_modules
+
+IMAGE_NAME = "site_%d.%s" # one-based site number, format
+TMP_SUFFIX = ".tmp"
+
+FONT_SIZE = 12 # in pixels
+ROW_HEIGHT = 16 # vertical space per tip
+CHAR_WIDTH = 0.6 # approximate width of a character, as a fraction of font size
+TREE_WIDTH = 600 # horizontal space for the tree itself, excluding labels
+MARGIN = 10
+LABEL_GAP = 4 # between a tip and its label
+LINE_WIDTH = 2
+LINE_COL = "#000000" # for branches, if they're not coloured
+
+SVG_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<svg xmlns="http://www.w3.org/2000/svg" width="%(width)d" height="%(height)d" viewBox="0 0 %(width)d %(height)d">
+<rect width="100%%" height="100%%" fill="#FFFFFF"/>
+<g stroke-width="%(line_width)d" stroke-linecap="square">
+%(lines)s
+</g>
+<g font-family="sans-serif" font-size="%(font_size)d">
+%(labels)s
+</g>
+</svg>
+"""
+SVG_LINE = '<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f" stroke="%s"/>'
+SVG_LABEL = '<text x="%.1f" y="%.1f" fill="%s" dominant-baseline="central">%s</text>'
+
+
+class TreeLayout:
+    """ Rectangular phylogram layout of a tree. Clades are referred to by their index in
+        preorder traversal, so the layout can be matched against any copy of the same tree.
+    """
+
+    def __init__(self, tree, n_sites):
+        self.clades = list(tree.find_clades(order="preorder"))
+        index = dict([ (clade, i) for i, clade in enumerate(self.clades) ])
+        self.parents = [None] * len(self.clades)
+        for i, clade in enumerate(self.clades):
+            for child in clade:
+                self.parents[index[child]] = i
+        self.tips = [ index[tip] for tip in tree.get_terminals() ] # in drawing order, top to bottom
+
+        # x from branch lengths (unit lengths if the tree has none), y from tip order
+        depths = tree.depths()
+        if max(depths.values()) == depths[tree.root]:
+            depths = tree.depths(unit_branch_lengths=True)
+        root_depth = depths[tree.root] # Biopython may give the root a branch length, which we don't draw
+        x_scale = TREE_WIDTH / ((max(depths.values()) - root_depth) or 1)
+        self.x = [ MARGIN + (depths[clade] - root_depth) * x_scale for clade in self.clades ]
+        self.y = [0.0] * len(self.clades)
+        for row, i in enumerate(self.tips):
+            self.y[i] = MARGIN + (row + 0.5) * ROW_HEIGHT
+        for i in reversed(range(len(self.clades))): # children come after parents in preorder
+            if not self.clades[i].is_terminal():
+                children = [ index[child] for child in self.clades[i] ]
+                self.y[i] = (self.y[children[0]] + self.y[children[-1]]) / 2
+        self.children_span = {} # internal clade -> (top, bottom) y of its vertical line
+        for i, clade in enumerate(self.clades):
+            if not clade.is_terminal():
+                self.children_span[i] = (self.y[index[clade.clades[0]]], self.y[index[clade.clades[-1]]])
+
+        # label metrics, allowing for the longest name with the longest site suffix
+        max_chars = max(len(self.clades[i].name) for i in self.tips) + len(STATE_SUFFIX % (n_sites, "X"))
+        self.width = int(MARGIN + TREE_WIDTH + LABEL_GAP + max_chars * FONT_SIZE * CHAR_WIDTH + MARGIN)
+        self.height = int(2 * MARGIN + len(self.tips) * ROW_HEIGHT)
+
+    def lines(self, colours):
+        """ Branch segments as (x1, y1, x2, y2, colour), given a colour per clade index """
+        segments = []
+        for i in range(len(self.clades)):
+            if self.parents[i] != None: # horizontal branch leading to this clade
+                segments.append((self.x[self.parents[i]], self.y[i], self.x[i], self.y[i], colours[i]))
+            if i in self.children_span: # vertical line joining its children
+                top, bottom = self.children_span[i]
+                segments.append((self.x[i], top, self.x[i], bottom, colours[i]))
+        return segments
+
+    def labels(self, tip_labels, colours):
+        """ Tip labels as (x, y, colour, text), given labels and colours per clade index """
+        return [ (self.x[i] + LABEL_GAP, self.y[i], colours[i], tip_labels[i]) for i in self.tips ]
+
+
+def site_colours(tree, alignment, taxon_dict, site, colours, states):
+    """ Colour the tree for a site, as for the text outputs, and return colours and labels per clade index """
+    BranchColor = newick_modules()[0].BranchColor
+
+    colour_tree(tree.root, alignment, taxon_dict, site, colours, states)
+    clades = list(tree.find_clades(order="preorder"))
+    hex_colours = [ BranchColor.to_hex(clade.color) for clade in clades ]
+    tip_labels = [ (clade.name + STATE_SUFFIX % (site+1, alignment[taxon_dict[clade.name]][site].upper()) if clade.is_terminal() else None) for clade in clades ]
+    return hex_colours, tip_labels
+
+
+def svg_text(layout, hex_colours, tip_labels, colour_branches):
+    from xml.sax.saxutils import escape
+
+    branch_colours = hex_colours if colour_branches else [LINE_COL] * len(hex_colours)
+    return SVG_TEMPLATE % {
+        'width': layout.width,
+        'height': layout.height,
+        'line_width': LINE_WIDTH,
+        'font_size': FONT_SIZE,
+        'lines': "\n".join([ SVG_LINE % segment for segment in layout.lines(branch_colours) ]),
+        'labels': "\n".join([ SVG_LABEL % (x, y, col, escape(text)) for x, y, col, text in layout.labels(tip_labels, hex_colours) ]),
+    }
+
+
+_fonts = {} # loaded once per process
+
+def png_font():
+    from PIL import ImageFont
+
+    if not _fonts:
+        try:
+            _fonts['label'] = ImageFont.load_default(size=FONT_SIZE)
+        except TypeError: # older Pillow, fixed size bitmap font
+            _fonts['label'] = ImageFont.load_default()
+    return _fonts['label']
+
+def write_png(layout, hex_colours, tip_labels, colour_branches, path):
+    from PIL import Image, ImageDraw
+
+    font = png_font()
+    branch_colours = hex_colours if colour_branches else [LINE_COL] * len(hex_colours)
+    image = Image.new("RGB", (layout.width, layout.height), "#FFFFFF")
+    draw = ImageDraw.Draw(image)
+    for x1, y1, x2, y2, col in layout.lines(branch_colours):
+        draw.line([(x1, y1), (x2, y2)], fill=col, width=LINE_WIDTH)
+    for x, y, col, text in layout.labels(tip_labels, hex_colours):
+        draw.text((x, y - FONT_SIZE / 2), text, fill=col, font=font)
+    image.save(path, "PNG")
+
+
+# state shared by the sites rendered in one process; set once per worker, rather than
+# pickling the tree and alignment again for every site
+_job = {}
+
+def _init_job(tree, alignment, colours, layout, out_dir, out_format, colour_branches):
+    _job.update(tree=tree, alignment=alignment, colours=colours, layout=layout, out_dir=out_dir,
+            out_format=out_format, colour_branches=colour_branches,
+            taxon_dict=dict([ (alignment[i].id, i) for i in range(len(alignment)) ]),
+            states=list(colours.keys()))
+
+def _render_site(site):
+    hex_colours, tip_labels = site_colours(_job['tree'], _job['alignment'],
+            _job['taxon_dict'], site, _job['colours'], _job['states'])
+    path = os.path.join(_job['out_dir'], IMAGE_NAME % (site+1, _job['out_format']))
+    tmp_path = path + TMP_SUFFIX # so an interrupted run never leaves a partial image behind
+    if _job['out_format'] == "svg":
+        f = open(tmp_path, "w")
+        f.write(svg_text(_job['layout'], hex_colours, tip_labels, _job['colour_branches']))
+        f.close()
+    else:
+        write_png(_job['layout'], hex_colours, tip_labels, _job['colour_branches'], tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def output_images(tree, alignment, sites, colours, out_dir, out_format, colour_branches, jobs=1, skip_existing=False):
+    """ Write one image per site into out_dir, using 'jobs' processes. Returns the paths of images written.
+        If skip_existing, sites whose image is already in out_dir (e.g. from an interrupted run) are left alone.
+    """
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    if skip_existing:
+        for name in os.listdir(out_dir): # partial images left by an interrupted run
+            if name.startswith("site_") and name.endswith(TMP_SUFFIX):
+                os.remove(os.path.join(out_dir, name))
+        sites = [ site for site in sites if not os.path.exists(os.path.join(out_dir, IMAGE_NAME % (site+1, out_format))) ]
+        if not sites:
+            return []
+    layout = TreeLayout(tree, alignment.get_alignment_length())
+    job_args = (tree, alignment, colours, layout, out_dir, out_format, colour_branches)
+    if jobs == 1:
+        _init_job(*job_args)
+        return [ _render_site(site) for site in sites ]
+
+    from multiprocessing import Pool
+    pool = Pool(jobs, initializer=_init_job, initargs=job_args)
+    try:
+        return pool.map(_render_site, sites)
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,174 @@
+#!/usr/bin/python
+""" Search alignment sites by how states are distributed over the tree, e.g. to find
+    sites where a clade is fixed for one state and its sister clade differs.
+
+    Usage (via the main CLI): python3 chroma_clade.py query <tree> <alignment> -clade <taxa>
+    The matching sites are printed in the same form accepted by the -s option.
+"""
+from fnmatch import fnmatchcase
+import os.path
+import sys
+
+from check_input import Input, InputError, SITES_DELIM, RANGE_DELIM
+
+NO_STATE = "\0" # marks a site where a clade's taxa don't all share one recognised state
+
+
+class SiteIndex:
+    """ Per-clade state summaries for every alignment site, built once so that queries are fast.
+        Uses the same rule as colour_tree(), applied to all sites at once: a clade has a state
+        at a site only if all its descendent taxa have that state, and the state is one of
+        'states' (i.e. has a colour); otherwise it has no state there.
+        Each summary is a string with one character per site, NO_STATE where there is no state.
+        Alongside, each clade's 'presence' maps each state to a bitmask of the sites where
+        any of its taxa have that state.
+    """
+
+    def __init__(self, tree, alignment, states):
+        self.tree = tree
+        self.length = alignment.get_alignment_length()
+        self.states = set(states)
+        self.seqs = dict([ (seq.id, str(seq.seq).upper()) for seq in alignment ])
+        self.summaries = {} # clade -> summary string
+        self.presence = {} # clade -> {state: bitmask of sites}
+        self.parents = {} # clade -> parent clade
+        self._summarise(tree.root)
+
+    def _summarise(self, parent):
+        if parent.is_terminal():
+            seq = self.seqs[parent.name]
+            summary = "".join([ s if s in self.states else NO_STATE for s in seq ])
+            presence = {}
+            for state in self.states.intersection(seq):
+                presence[state] = int("".join([ "1" if s == state else "0" for s in reversed(seq) ]), 2) # bit i is site i
+        else:
+            summary, presence = None, {}
+            for child in parent:
+                self.parents[child] = parent
+                child_summary = self._summarise(child)
+                if summary == None:
+                    summary = child_summary
+                else: # a state survives only where it is shared, cf. elementwise product in colour_tree()
+                    summary = "".join([ a if a == b else NO_STATE for a, b in zip(summary, child_summary) ])
+                for state, mask in self.presence[child].items(): # a state is present where any child has it
+                    presence[state] = presence.get(state, 0) | mask
+        self.summaries[parent] = summary
+        self.presence[parent] = presence
+        return summary
+
+    def get_summary(self, clade): return self.summaries[clade]
+
+    def find_taxa(self, patterns):
+        """ Names of taxa matching any of the given names or shell-style wildcard patterns """
+        names = [ tip.name for tip in self.tree.get_terminals() ]
+        taxa = [ name for name in names if any(fnmatchcase(name, p) for p in patterns) ]
+        if not taxa:
+            raise InputError("Oops: no taxa match '%s'" % SITES_DELIM.join(patterns))
+        return taxa
+
+    def find_clade(self, taxa):
+        """ Smallest clade containing all the named taxa """
+        return self.tree.common_ancestor(taxa)
+
+    def sisters(self, clade):
+        """ The clade's sister clades, i.e. all other children of its parent """
+        if clade not in self.parents:
+            raise InputError("Oops: chosen clade is the whole tree, so has no sister clade")
+        return [ sister for sister in self.parents[clade] if sister is not clade ]
+
+    def sister_summary(self, clade):
+        """ Summary for the clade's sister, taken as all its sister clades together """
+        summary = None
+        for sister in self.sisters(clade):
+            if summary == None:
+                summary = self.summaries[sister]
+            else:
+                summary = "".join([ a if a == b else NO_STATE for a, b in zip(summary, self.summaries[sister]) ])
+        return summary
+
+    def sister_presence(self, clade):
+        """ Presence of each state among the taxa of the clade's sister clades """
+        presence = {}
+        for sister in self.sisters(clade):
+            for state, mask in self.presence[sister].items():
+                presence[state] = presence.get(state, 0) | mask
+        return presence
+
+    def fixed_sites(self, clade):
+        """ Zero-based sites where all taxa in the clade share one state """
+        return [ i for i, s in enumerate(self.summaries[clade]) if s != NO_STATE ]
+
+    def distinct_sites(self, clade, strict=False):
+        """ Zero-based sites where the clade is fixed for one state that no taxon in its sister clade has.
+            If strict, the sister must also be fixed, for a different state.
+        """
+        summary = self.summaries[clade]
+        if strict:
+            sister = self.sister_summary(clade)
+            return [ i for i in range(self.length) if summary[i] != NO_STATE and sister[i] != NO_STATE and summary[i] != sister[i] ]
+        presence = self.sister_presence(clade)
+        return [ i for i in range(self.length) if summary[i] != NO_STATE and not (presence.get(summary[i], 0) >> i) & 1 ]
+
+    def shared_sites(self, taxa):
+        """ Zero-based sites where all the named taxa share one state (they needn't form a clade) """
+        seqs = [ self.seqs[name] for name in taxa ]
+        first = seqs[0]
+        return [ i for i in range(self.length) if first[i] in self.states and all(seq[i] == first[i] for seq in seqs) ]
+
+
+def sites_string(sites):
+    """ Format zero-based sites as a one-based site string for the -s option, e.g. '2,4-6,10' """
+    sections = []
+    for site in sorted(set(sites)):
+        if sections and sections[-1][1] == site: # extends the current range
+            sections[-1][1] = site + 1
+        else:
+            sections.append([site + 1, site + 1])
+    return SITES_DELIM.join([ str(a) if a == b else "%d%s%d" % (a, RANGE_DELIM, b) for a, b in sections ])
+
+
+def main(argv=None):
+    import argparse
+    from annotate import GENERIC_ERR_MSG
+    parser = argparse.ArgumentParser(prog="chroma_clade.py query",
+            description="Find alignment sites by how states are distributed over the tree. Matching sites are printed in the form taken by the -s option.")
+    parser.add_argument( "tree", type=str, help="File containing the unannotated tree")
+    parser.add_argument( "alignment", type=str, help="File containing an alignment of the molecular sequences, either amino acids or nucleotides")
+    parser.add_argument( "-tf", metavar="<tree_format>", default="newick", type=str, help="Tree file format, 'newick' (default), 'nexus' or 'phyloxml'" )
+    parser.add_argument( "-af", metavar="<alignment_format>", default="fasta", type=str, help="Alignment file format, 'fasta' (default) or 'nexus'" )
+    parser.add_argument( "-c", metavar="<colour_file>", default=None, type=str, help="Colour file as for the main CLI; only states listed in it are matched" )
+    parser.add_argument( "-s", metavar="<sites>", default=None, type=str, help="Only search this subrange of alignment sites, e.g. '2,4-6,10'" )
+    query = parser.add_mutually_exclusive_group(required=True)
+    query.add_argument( "-clade", metavar="<taxa>", default=None, type=str, help="Sites where the smallest clade containing these taxa is fixed for one state that none of its sister clade's taxa have. Taxa are comma separated names, '*' wildcards allowed, e.g. 'Hu_*1957*,Hu_*1968*'" )
+    query.add_argument( "-shared", metavar="<taxa>", default=None, type=str, help="Sites where all these taxa share one state, whether or not they form a clade" )
+    parser.add_argument( "-strict", action="store_true", help="With -clade, require the sister clade to be fixed for a different state too")
+
+    args = parser.parse_args(argv)
+
+    # NB errors go to stderr with a non-zero exit, so that nothing but sites is ever passed on to -s
+    try:
+        colour_file_path = args.c if args.c != None else os.path.join(os.path.split(__file__)[0], Input.DEFAULT_COL_FILE)
+        usr = Input(args.tree, args.alignment, False, args.tf, args.af, colour_file_path, sites_string=args.s)
+        index = SiteIndex(usr.get_tree(), usr.get_align(), usr.get_colours().keys())
+        if args.clade != None:
+            taxa = index.find_taxa(args.clade.split(SITES_DELIM))
+            sites = index.distinct_sites(index.find_clade(taxa), args.strict)
+        else:
+            sites = index.shared_sites(index.find_taxa(args.shared.split(SITES_DELIM)))
+    except InputError as e:
+        parser.print_help(sys.stderr)
+        sys.stderr.write("\n%s\n" % str(e))
+        sys.exit(1)
+    except Exception as e:
+        sys.stderr.write("%s\n\nException: %s\n" % (GENERIC_ERR_MSG, str(e)))
+        sys.exit(1)
+
+    searched = set(usr.get_sites())
+    sites = [ site for site in sites if site in searched ]
+    if not sites: # an empty site string would mean all sites to -s
+        sys.stderr.write("No matching sites\n")
+        sys.exit(1)
+    print(sites_string(sites))
+
+if __name__ == "__main__":
+    main()
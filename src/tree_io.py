@@ -0,0 +1,56 @@
+#!/usr/bin/python
+""" Access to Biopython's tree modules without paying for the ones a job doesn't use.
+    Importing anything from Bio.Phylo runs its __init__, which imports every tree format
+    (Nexus, PhyloXML, NeXML, ...) and their dependencies. Newick jobs only need BaseTree,
+    Newick and NewickIO, so these are loaded on their own; the rest of Bio.Phylo is only
+    imported, through phylo(), when a job needs another format.
+"""
+import os.path
+import sys
+
+NEWICK_MODULES = ["BaseTree", "Newick", "NewickIO"]
+TREE_FORMATS = ["newick", "nexus", "phyloxml", "nexml", "cdao"] # as Bio.Phylo._io.supported_formats
+
+
+def newick_modules():
+    """ Bio.Phylo's BaseTree and NewickIO modules, loaded without running Bio.Phylo's __init__ """
+    if "Bio.Phylo" in sys.modules: # the real package is already loaded
+        from Bio.Phylo import BaseTree, NewickIO
+        return BaseTree, NewickIO
+
+    if "Bio.Phylo.NewickIO" not in sys.modules:
+        import types
+        import Bio
+
+        # stand-in package, just so the submodules can be found and import each other
+        package = types.ModuleType("Bio.Phylo")
+        package.__path__ = [os.path.join(os.path.dirname(Bio.__file__), "Phylo")]
+        sys.modules["Bio.Phylo"] = package
+        try:
+            from Bio.Phylo import BaseTree, Newick, NewickIO
+        finally:
+            del sys.modules["Bio.Phylo"] # the real package is imported as usual if needed later, and reuses these
+    return sys.modules["Bio.Phylo.BaseTree"], sys.modules["Bio.Phylo.NewickIO"]
+
+
+def phylo():
+    """ The full Bio.Phylo package, for formats other than Newick """
+    from Bio import Phylo
+    # submodules loaded by newick_modules() aren't attributes of the real package, so add them
+    for name in NEWICK_MODULES:
+        if not hasattr(Phylo, name) and ("Bio.Phylo." + name) in sys.modules:
+            setattr(Phylo, name, sys.modules["Bio.Phylo." + name])
+    return Phylo
+
+
+def read_tree(path, tree_format):
+    """ Read the single tree in a file, as Bio.Phylo.read() does """
+    if tree_format != "newick":
+        return phylo().read(path, tree_format)
+
+    BaseTree, NewickIO = newick_modules()
+    with open(path) as f:
+        trees = list(NewickIO.parse(f))
+    if len(trees) != 1:
+        raise ValueError("There should be exactly one tree in this file, found %d" % len(trees))
+    return trees[0]
@@ -0,0 +1,84 @@
+#!/usr/bin/python
+""" Startup benchmark for the ChromaClade CLI.
+    Times 'chroma_clade.py -h' and a minimal Newick + Fasta -> FigTree run on the
+    small test dataset, where nearly all of the wall time is spent importing modules.
+    Run from anywhere, e.g.
+
+    $ python3 test/bench_startup.py -n 20
+
+    Pass limits in seconds (-max_help, -max_run) to make it exit non-zero on regression.
+"""
+import os.path
+import subprocess
+import sys
+import tempfile
+import time
+
+TEST_DIR = os.path.split(os.path.abspath(__file__))[0]
+SRC_DIR = os.path.join(os.path.dirname(TEST_DIR), "src")
+CLI = os.path.join(SRC_DIR, "chroma_clade.py")
+
+TREE = os.path.join(TEST_DIR, "4tree.nwk.tre")
+ALIGN = os.path.join(TEST_DIR, "4aln.fasta")
+
+# modules a Newick + Fasta -> FigTree job should not import: the alignment readers for other
+# formats, and the Bio.Phylo package __init__, which brings in the Nexus and PhyloXML stacks
+UNWANTED = ["Bio.AlignIO", "Bio.SeqIO", "Bio.Phylo", "Bio.Phylo._io", "Bio.Phylo.NexusIO", "Bio.Nexus", "Bio.Nexus.Nexus",
+        "Bio.Phylo.PhyloXML", "Bio.Phylo.PhyloXMLIO", "Bio.Phylo.NeXMLIO"]
+
+def time_command(cmd, repeats):
+    """ Run cmd 'repeats' times and return the wall time of each run, in seconds """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+def imported_modules(cmd):
+    """ Names of modules imported by running cmd, as reported by 'python -X importtime' """
+    proc = subprocess.run([cmd[0], "-X", "importtime"] + cmd[1:], stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return set( line.split("|")[-1].strip() for line in proc.stderr.splitlines() if line.startswith("import time:") )
+
+def report(label, times):
+    times = sorted(times)
+    print("%-8s min %.3fs  median %.3fs  max %.3fs" % (label, times[0], times[len(times)//2], times[-1]))
+    return times[len(times)//2]
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument( "-n", metavar="<repeats>", default=10, type=int, help="Number of timed runs of each command (default 10)" )
+    parser.add_argument( "-max_help", metavar="<seconds>", default=None, type=float, help="Fail if median time of 'chroma_clade.py -h' exceeds this" )
+    parser.add_argument( "-max_run", metavar="<seconds>", default=None, type=float, help="Fail if median time of the minimal run exceeds this" )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        out_path = os.path.join(out_dir, "col_4tree.nwk.tre")
+        help_cmd = [sys.executable, CLI, "-h"]
+        run_cmd = [sys.executable, CLI, TREE, ALIGN, "-s", "1", "-o", out_path]
+
+        help_median = report("help", time_command(help_cmd, args.n))
+        run_median = report("run", time_command(run_cmd, args.n))
+
+        failed = False
+        help_bio = sorted( m for m in imported_modules(help_cmd) if m.startswith("Bio") )
+        if help_bio:
+            print("'-h' imported %d Biopython modules, e.g. %s" % (len(help_bio), ", ".join(help_bio[:5])))
+            failed = True
+        run_unwanted = sorted( imported_modules(run_cmd).intersection(UNWANTED) )
+        if run_unwanted:
+            print("minimal run imported: %s" % ", ".join(run_unwanted))
+            failed = True
+
+    if args.max_help != None and help_median > args.max_help:
+        print("'-h' median %.3fs exceeds limit %.3fs" % (help_median, args.max_help))
+        failed = True
+    if args.max_run != None and run_median > args.max_run:
+        print("minimal run median %.3fs exceeds limit %.3fs" % (run_median, args.max_run))
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()